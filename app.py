@@ -1,25 +1,36 @@
 import os
 import json
 import base64
+import queue
+import asyncio
+import hashlib
+import threading
 
 import streamlit as st
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
+from inbox import InboxItem
+from openai_client import get_client, get_request_semaphore, run_async, submit_async
 
 # ---------- Load environment variables ----------
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Initialize OpenAI client
-if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
-else:
-    client = None
+# Shared OpenAI client (None if the API key is missing)
+client = get_client()
 
 # ---------- Streamlit page config ----------
 st.set_page_config(
@@ -47,18 +58,38 @@ if "email_text" not in st.session_state:
     st.session_state["email_text"] = ""
 if "gmail_messages" not in st.session_state:
     st.session_state["gmail_messages"] = []
+if "gmail_bodies" not in st.session_state:
+    st.session_state["gmail_bodies"] = {}
+if "inbox_batch_id" not in st.session_state:
+    st.session_state["inbox_batch_id"] = None
+if "inbox_analysis" not in st.session_state:
+    st.session_state["inbox_analysis"] = {}
+if "result" not in st.session_state:
+    st.session_state["result"] = None
 
 # ---------- Gmail API helpers (local use only) ----------
 
 # We only need read-only access to Gmail
 GMAIL_SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
+# Gmail accepts at most 100 calls per batch request
+GMAIL_BATCH_SIZE = 100
 
-def get_gmail_service():
+
+@st.cache_resource
+def load_gmail_credentials():
     """
-    Returns an authenticated Gmail API service.
-    Only works locally with credentials.json present.
+    Returns the Gmail OAuth credentials.
+    token.json is read once per process (st.cache_resource survives reruns)
+    and only written back when credentials are refreshed or obtained
+    through the login flow.
     """
+    # Imported lazily: the Google client stack is heavy and only needed
+    # when Gmail mode is actually used.
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+
     creds = None
 
     # token.json stores the user's access and refresh tokens
@@ -84,80 +115,134 @@ def get_gmail_service():
         with open("token.json", "w") as token:
             token.write(creds.to_json())
 
-    service = build("gmail", "v1", credentials=creds)
+    return creds
+
+
+@st.cache_resource
+def get_gmail_service():
+    """
+    Returns an authenticated Gmail API service.
+    Only works locally with credentials.json present.
+    The service is built once and reused across reruns.
+    """
+    from googleapiclient.discovery import build
+
+    creds = load_gmail_credentials()
+
+    # static_discovery: use the discovery document bundled with
+    # google-api-python-client instead of fetching it over HTTP.
+    # cache_discovery=False: skip the discovery file-cache lookup (and its
+    # "file_cache is unavailable" warning), which runs before the static path.
+    service = build(
+        "gmail",
+        "v1",
+        credentials=creds,
+        static_discovery=True,
+        cache_discovery=False,
+    )
     return service
 
 
-def list_gmail_messages(service, max_results=10):
+def execute_gmail_batch(service, requests):
+    """
+    Execute Gmail API requests through the HTTP batch endpoint
+    (one round trip per chunk of GMAIL_BATCH_SIZE instead of one per request).
+    `requests` is a list of (request_id, request) tuples.
+    Returns a dict {request_id: response}; failed requests are left out.
+    """
+    responses = {}
+
+    def on_response(request_id, response, exception):
+        if exception is None:
+            responses[request_id] = response
+
+    for start in range(0, len(requests), GMAIL_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=on_response)
+        for request_id, request in requests[start : start + GMAIL_BATCH_SIZE]:
+            batch.add(request, request_id=request_id)
+        batch.execute()
+
+    return responses
+
+
+@st.cache_data(ttl=300)
+def list_gmail_messages(_service, max_results=10):
     """
     List last messages in the user's inbox (basic info).
-    Returns a list of dicts with id, snippet, and headers (From, Subject).
+    Returns a list of InboxItem with id, sender, subject, and snippet.
+    Results are cached for 5 minutes (the service argument is not hashed).
     """
     results = (
-        service.users()
+        _service.users()
         .messages()
         .list(
             userId="me",
             labelIds=["INBOX"],
             maxResults=max_results,
+            fields="messages/id,nextPageToken",
         )
         .execute()
     )
 
     messages = results.get("messages", [])
 
+    # Fetch metadata for all messages in a single batch
+    details = execute_gmail_batch(
+        _service,
+        [
+            (
+                msg["id"],
+                _service.users()
+                .messages()
+                .get(
+                    userId="me",
+                    id=msg["id"],
+                    format="metadata",
+                    metadataHeaders=["From", "Subject"],
+                    fields="id,snippet,payload/headers",
+                ),
+            )
+            for msg in messages
+        ],
+    )
+
     items = []
     for msg in messages:
-        msg_detail = (
-            service.users()
-            .messages()
-            .get(
-                userId="me",
-                id=msg["id"],
-                format="metadata",
-                metadataHeaders=["From", "Subject"],
-            )
-            .execute()
-        )
+        msg_detail = details.get(msg["id"])
+        if msg_detail is None:
+            continue
 
         headers = msg_detail.get("payload", {}).get("headers", [])
         header_dict = {h["name"]: h["value"] for h in headers}
         snippet = msg_detail.get("snippet", "")
 
         items.append(
-            {
-                "id": msg["id"],
-                "from": header_dict.get("From", "Unknown"),
-                "subject": header_dict.get("Subject", "(No subject)"),
-                "snippet": snippet,
-            }
+            InboxItem(
+                id=msg["id"],
+                sender=header_dict.get("From", "Unknown"),
+                subject=header_dict.get("Subject", "(No subject)"),
+                snippet=snippet,
+            )
         )
 
     return items
 
 
-def get_gmail_message_body(service, message_id: str) -> str:
+def decode_data(data: str) -> str:
+    return (
+        base64.urlsafe_b64decode(data)
+        .decode("UTF-8", errors="ignore")
+        .strip()
+    )
+
+
+def extract_body_text(payload: dict) -> str:
     """
-    Fetch the full body text of a Gmail message.
+    Extract the body text from a Gmail message payload.
     Tries to read text/plain first, then text/html as fallback.
     """
-    msg = (
-        service.users()
-        .messages()
-        .get(userId="me", id=message_id, format="full")
-        .execute()
-    )
-
-    payload = msg.get("payload", {})
     parts = payload.get("parts", [])
 
-    def decode_data(data: str) -> str:
-        return (
-            base64.urlsafe_b64decode(data.encode("UTF-8"))
-            .decode("UTF-8", errors="ignore")
-            .strip()
-        )
-
     body_text = ""
 
     # Single-part email
@@ -182,7 +267,436 @@ def get_gmail_message_body(service, message_id: str) -> str:
     return body_text
 
 
+@st.cache_data(ttl=300)
+def get_gmail_message_body(_service, message_id: str) -> str:
+    """
+    Fetch the full body text of a Gmail message.
+    Results are cached for 5 minutes (the service argument is not hashed).
+    """
+    msg = (
+        _service.users()
+        .messages()
+        .get(userId="me", id=message_id, format="full", fields="payload")
+        .execute()
+    )
+
+    return extract_body_text(msg.get("payload", {}))
+
+
+@st.cache_data(ttl=300)
+def prefetch_gmail_message_bodies(_service, message_ids):
+    """
+    Fetch the full body text of several Gmail messages in a single batch.
+    Returns a dict {message_id: body_text}.
+    Results are cached for 5 minutes (the service argument is not hashed).
+    """
+    messages = execute_gmail_batch(
+        _service,
+        [
+            (
+                message_id,
+                _service.users()
+                .messages()
+                .get(userId="me", id=message_id, format="full", fields="payload"),
+            )
+            for message_id in message_ids
+        ],
+    )
+
+    return {
+        message_id: extract_body_text(msg.get("payload", {}))
+        for message_id, msg in messages.items()
+    }
+
+
+def load_gmail_message_body(message_id: str) -> str:
+    """
+    Return the body of a Gmail message, using the bodies prefetched
+    with the inbox list and falling back to the network.
+    """
+    bodies = st.session_state["gmail_bodies"]
+    if message_id not in bodies:
+        bodies[message_id] = get_gmail_message_body(get_gmail_service(), message_id)
+    return bodies[message_id]
+
+
 # ---------- Helper: analyze email + generate replies ----------
+
+# Bump when the prompts change, so that cached results are not reused
+CACHE_VERSION = 2
+
+# Upper bound on generated tokens for a single reply, per requested length
+REPLY_MAX_TOKENS = {
+    "Short": 300,
+    "Medium": 500,
+    "Long": 900,
+}
+
+
+# Static system prompts: kept byte-identical across calls so that
+# OpenAI can reuse the cached prompt prefix.
+ANALYSIS_SYSTEM_PROMPT = "You analyze emails for busy professionals; follow the JSON schema."
+
+REPLY_SYSTEM_PROMPT = (
+    "You draft email replies in the language of the original email, "
+    "matching the requested tone, formality and length "
+    "(Short = 3–5 sentences, Medium = 6–10, Long = more detailed). "
+    "Output only: 'Subject: <subject>', a blank line, then the body."
+)
+
+# Few-shot examples appended to the reply system prompt. Besides showing the
+# expected format, they push the static prefix over the 1024 tokens needed
+# for OpenAI automatic prompt caching, so the reply calls of a generation
+# (and later generations) reuse the cached prefill.
+REPLY_FEW_SHOT_EXAMPLES = """
+
+Examples of requests and of the expected replies:
+
+### Example 1
+Tone: Professional
+Formality: Formal
+Length: Short
+Option 1 of 2 (make it distinct).
+
+Email:
+Hello, I ordered a standing desk (order #48213) three weeks ago and it still has not shipped. The website says 5–7 business days. Could you tell me what is going on? I need it before the end of the month because I am moving into a new office. Regards, Mark Ellis
+
+Reply:
+Subject: Re: Status of order #48213
+
+Dear Mr. Ellis,
+
+Thank you for contacting us, and please accept our apologies for the delay with order #48213. The desk was held back by a stock shortage at our warehouse, which has now been resolved, and it is scheduled to ship within the next two business days. You will receive a tracking number by email as soon as it leaves our facility, and delivery is expected well before the end of the month.
+
+Kind regards,
+Customer Care Team
+
+### Example 2
+Tone: Friendly
+Formality: Informal
+Length: Short
+Option 2 of 3 (make it distinct).
+
+Email:
+Hey! Are we still on for the team lunch on Friday? A couple of people asked if we could move it to 1pm instead of 12:30 because of the sprint review. Let me know what you think. Cheers, Priya
+
+Reply:
+Subject: Re: Friday team lunch
+
+Hi Priya,
+
+Yes, we're definitely still on! 1pm works perfectly for me, and it makes a lot of sense with the sprint review running late. I'll update the booking at the restaurant and send a quick note to the rest of the team so everyone knows. See you Friday!
+
+Cheers
+
+### Example 3
+Tone: Assertive
+Formality: Formal
+Length: Medium
+Option 1 of 1 (make it distinct).
+
+Email:
+Dear supplier, the last two deliveries of packaging material arrived damaged and incomplete. This has caused a production stop of almost a full day on our line. We expect a written explanation and a proposal for compensation by Wednesday, otherwise we will have to reconsider our contract. Best regards, Laura Bianchi, Purchasing Manager
+
+Reply:
+Subject: Re: Damaged and incomplete packaging deliveries
+
+Dear Ms. Bianchi,
+
+Thank you for your message, and we fully acknowledge the seriousness of the situation. The last two deliveries did not meet the standards agreed in our contract, and we understand the impact the production stop has had on your line. We have already opened an internal investigation with our logistics partner to identify where the damage occurred and why the shipments were incomplete.
+
+You will receive a written report with the root cause and the corrective actions by Tuesday, one day ahead of your deadline. In the same document we will propose a compensation covering the missing material and the costs of the production stop. In the meantime, a replacement shipment has been prioritized and will reach your plant within 48 hours.
+
+We value our partnership and are committed to restoring your confidence in our service.
+
+Yours sincerely,
+Account Management
+
+### Example 4
+Tone: Neutral
+Formality: Neutral
+Length: Short
+Option 1 of 2 (make it distinct).
+
+Email:
+Ciao, volevo sapere se è possibile spostare la riunione di giovedì alle 15 a venerdì mattina. Giovedì pomeriggio ho un impegno con un cliente che non riesco a spostare. Grazie, Marco
+
+Reply:
+Subject: Re: Spostamento riunione di giovedì
+
+Ciao Marco,
+
+nessun problema, possiamo spostare la riunione a venerdì mattina. Ti propongo le 10:00, se per te va bene aggiorno subito l'invito nel calendario. Fammi sapere se preferisci un altro orario.
+
+Un saluto
+
+### Example 5
+Tone: Professional
+Formality: Very formal
+Length: Medium
+Option 2 of 2 (make it distinct).
+
+Email:
+Dear team, I am writing to request access to the quarterly sales reports for the EMEA region for the past two years. I am preparing an analysis for the board meeting next month and would need the data in spreadsheet format if possible. Thank you in advance. Sincerely, Dr. Helena Novak, Head of Strategy
+
+Reply:
+Subject: Re: Request for EMEA quarterly sales reports
+
+Dear Dr. Novak,
+
+Thank you for your request. We would be pleased to provide the quarterly sales reports for the EMEA region covering the past two years in support of your analysis for the board meeting.
+
+The data will be exported in spreadsheet format, with one sheet per quarter and a summary sheet with the year-over-year comparison. As some of the figures include confidential customer information, the files will be shared through the secure document portal, to which you will receive an access invitation shortly.
+
+We expect to have everything ready by the end of this week. Should you require any additional breakdowns, for instance by country or product line, please do not hesitate to let us know.
+
+Yours faithfully,
+Sales Operations
+
+### Example 6
+Tone: Friendly
+Formality: Formal
+Length: Long
+Option 1 of 3 (make it distinct).
+
+Email:
+Hello, my name is Sophie and I am a student at the University of Lyon. I read your article about sustainable supply chains and found it really inspiring. I am writing my master's thesis on a similar topic and I was wondering whether you would be available for a short interview, maybe 30 minutes online, sometime in the next few weeks. I would be very grateful for your help. Best wishes, Sophie Laurent
+
+Reply:
+Subject: Re: Interview request for your master's thesis
+
+Dear Sophie,
+
+Thank you very much for your kind message, and I am delighted to hear that the article on sustainable supply chains was useful for your research. It is always a pleasure to see students choosing this topic for their thesis, as it is becoming more and more relevant for companies of every size.
+
+I would be happy to help with a short online interview. Thirty minutes sounds like a good length, and I am generally available on Tuesday and Thursday afternoons over the next three weeks. If you send me two or three slots that suit you, I will confirm one and share a video call link.
+
+To make the most of our time, it would be helpful if you could send me your main questions a few days in advance. I can also share a couple of case studies and reports that were not included in the article and that might support your analysis.
+
+I look forward to our conversation and wish you the best of luck with your thesis.
+
+Warm regards
+
+### End of examples
+"""
+
+# JSON schema enforced by OpenAI structured outputs for the analysis
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "language": {"type": "string", "description": "Language of the email."},
+        "urgency": {"type": "string", "enum": ["low", "medium", "high"]},
+        "sentiment": {
+            "type": "string",
+            "enum": ["positive", "neutral", "negative", "mixed"],
+        },
+        "category": {
+            "type": "string",
+            "description": "e.g. inquiry, complaint, follow_up, update, other.",
+        },
+        "summary": {"type": "string", "description": "2–4 sentences."},
+        "action_items": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Concrete tasks for the recipient.",
+        },
+    },
+    "required": [
+        "language",
+        "urgency",
+        "sentiment",
+        "category",
+        "summary",
+        "action_items",
+    ],
+    "additionalProperties": False,
+}
+
+
+def analysis_request_body(email_text: str) -> dict:
+    """
+    Build the chat completion request used to analyze an email.
+    Shared by the interactive flow and the inbox batch.
+    """
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": email_text},
+        ],
+        "temperature": 0.2,
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "email_analysis",
+                "strict": True,
+                "schema": ANALYSIS_SCHEMA,
+            },
+        },
+    }
+
+
+@retry(
+    retry=retry_if_exception_type(
+        (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+    ),
+    wait=wait_random_exponential(min=1, max=20),
+    stop=stop_after_attempt(4),
+    reraise=True,
+)
+async def create_chat_completion(**kwargs):
+    """
+    Call the OpenAI chat completions API, retrying transient failures
+    (rate limits, timeouts, connection and server errors) with
+    exponential backoff.
+    Callers hold the shared request semaphore for the whole request
+    (including reading a stream), so it is not acquired here.
+    """
+    return await client.chat.completions.create(**kwargs)
+
+
+async def analyze_email(email_text: str):
+    """
+    Use OpenAI to detect language, urgency, sentiment and category,
+    summarize the email and extract action items.
+    Returns a dict with parsed JSON.
+    """
+    async with get_request_semaphore():
+        response = await create_chat_completion(**analysis_request_body(email_text))
+
+    return json.loads(response.choices[0].message.content)
+
+
+async def stream_reply_option(
+    email_text: str,
+    tone: str,
+    formality: str,
+    length: str,
+    option_number: int,
+    num_options: int,
+):
+    """
+    Use OpenAI to generate a single reply option.
+    Yields the reply text chunk by chunk as the model produces it.
+    The first line of the full text is "Subject: <subject>".
+    """
+    user_prompt = (
+        f"Tone: {tone}\n"
+        f"Formality: {formality}\n"
+        f"Length: {length}\n"
+        f"Option {option_number} of {num_options} (make it distinct).\n\n"
+        f"Email:\n{email_text}"
+    )
+
+    # The request slot is held until the stream has been fully read
+    async with get_request_semaphore():
+        stream = await create_chat_completion(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": REPLY_SYSTEM_PROMPT + REPLY_FEW_SHOT_EXAMPLES},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.7,
+            max_tokens=REPLY_MAX_TOKENS.get(length, 500),
+            stream=True,
+        )
+
+        async for chunk in stream:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
+
+
+def split_reply(reply_text: str):
+    """
+    Split a streamed reply into a dict with subject + body.
+    """
+    reply_text = reply_text.strip()
+    first_line, _, rest = reply_text.partition("\n")
+
+    if first_line.lower().startswith("subject:"):
+        return {
+            "subject": first_line[len("subject:"):].strip(),
+            "body": rest.strip(),
+        }
+
+    return {"subject": "", "body": reply_text}
+
+
+async def generate_analysis_and_replies(
+    email_text: str,
+    tone: str,
+    formality: str,
+    length: str,
+    num_options: int,
+    events: queue.Queue,
+):
+    """
+    Request the analysis and every reply option concurrently.
+    The first failure cancels the remaining requests.
+    Progress is reported on `events` as ("analysis", analysis) and
+    ("reply", option_number, reply_text_so_far) tuples.
+
+    Returns a dict with the analysis and the list of replies.
+    """
+    async def run_analysis():
+        analysis = await analyze_email(email_text)
+        events.put(("analysis", analysis))
+        return analysis
+
+    async def run_reply(option_number):
+        reply_text = ""
+        async for delta in stream_reply_option(
+            email_text, tone, formality, length, option_number, num_options
+        ):
+            reply_text += delta
+            events.put(("reply", option_number, reply_text))
+
+        return split_reply(reply_text)
+
+    tasks = [
+        asyncio.create_task(run_analysis()),
+        *[asyncio.create_task(run_reply(i + 1)) for i in range(num_options)],
+    ]
+
+    # If any request fails, cancel the others so they stop consuming
+    # tokens; the first error is raised to the caller.
+    try:
+        analysis, *replies = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    data = dict(analysis)
+    data["replies"] = replies
+    return data
+
+
+def generation_cache_key(
+    email_text: str,
+    tone: str,
+    formality: str,
+    length: str,
+    num_options: int,
+) -> str:
+    """
+    Build the cache key of a generation: a short hash of the email
+    plus the reply preferences.
+    """
+    email_hash = hashlib.blake2b(email_text.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{CACHE_VERSION}:{email_hash}:{tone}:{formality}:{length}:{num_options}"
+
+
+@st.cache_resource
+def get_result_cache():
+    """
+    Returns the cache of previous generation results (shared across sessions)
+    and the lock guarding it.
+    Entries expire after 1 hour; at most 128 are kept.
+    """
+    return TTLCache(maxsize=128, ttl=3600), threading.Lock()
+
+
 def analyze_and_reply(
     email_text: str,
     tone: str,
@@ -198,95 +712,317 @@ def analyze_and_reply(
     - extract action items
     - generate N reply options with subject + body
 
+    The analysis and every reply option are requested concurrently.
+    The analysis is rendered as soon as it arrives, and each reply is
+    streamed token by token into its own tab while it is generated.
+
     Returns either:
-    - dict with parsed JSON
+    - dict with the analysis and the list of replies
     - or a string with an error message
     """
     if client is None:
         return "Error: OpenAI client is not configured. Check your API key."
 
-    system_prompt = (
-        "You are an advanced AI email assistant. "
-        "You help busy professionals understand and reply to emails. "
-        "You ALWAYS respond with a single valid JSON object, no extra text. "
-        "Your tasks:\n"
-        "- Detect the language of the original email and reply in the SAME language.\n"
-        "- Estimate urgency: one of ['low', 'medium', 'high'].\n"
-        "- Estimate sentiment: one of ['positive', 'neutral', 'negative', 'mixed'].\n"
-        "- Classify the email category: e.g. 'inquiry', 'complaint', 'follow_up', 'update', 'other'.\n"
-        "- Provide a short summary of the email (2–4 sentences).\n"
-        "- Extract a list of concrete action items (tasks the recipient should do).\n"
-        "- Generate multiple reply options (subject + body) following the requested tone, formality, and length.\n"
+    analysis_area = st.container()
+
+    st.markdown("### AI-generated reply options")
+    tabs = st.tabs([f"Option {i+1}" for i in range(num_options)])
+    placeholders = []
+    for tab in tabs:
+        with tab:
+            placeholders.append(st.empty())
+
+    # The requests run on the shared OpenAI event loop; the UI is updated
+    # here, in the Streamlit script thread.
+    events = queue.Queue()
+    future = submit_async(
+        generate_analysis_and_replies(
+            email_text, tone, formality, length, num_options, events
+        )
     )
 
-    user_prompt = f"""
-You will receive an email and some preferences for the reply.
+    try:
+        while not (future.done() and events.empty()):
+            try:
+                event = events.get(timeout=0.05)
+            except queue.Empty:
+                continue
 
-Email:
-\"\"\"{email_text}\"\"\"
-
-Preferences:
-- Tone: {tone}
-- Formality: {formality}
-- Length: {length} 
-  (Short = 3–5 sentences, Medium = 6–10 sentences, Long = more detailed)
-- Number of reply options: {num_options}
-
-Return ONLY a JSON object with the following EXACT structure (no comments, no extra text):
-
-{{
-  "language": "<detected_language_code_or_name>",
-  "urgency": "<low|medium|high>",
-  "sentiment": "<positive|neutral|negative|mixed>",
-  "category": "<short_category_label>",
-  "summary": "<short_paragraph_summary>",
-  "action_items": [
-    "<item_1>",
-    "<item_2>"
-  ],
-  "replies": [
-    {{
-      "subject": "<suggested_subject_line>",
-      "body": "<full_email_body_ready_to_send>"
-    }}
-  ]
-}}
-
-Rules:
-- The length and style of each reply must match the user's preferences.
-- The number of elements in 'replies' MUST be exactly {num_options}.
-- Do NOT include any explanation outside the JSON.
-"""
+            if event[0] == "analysis":
+                with analysis_area:
+                    render_analysis(event[1])
+            else:
+                _, option_number, reply_text = event
+                placeholders[option_number - 1].markdown(f"```text\n{reply_text}\n```")
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.7,
+        return future.result()
+
+    except Exception as e:
+        return f"Error while calling OpenAI API: {e}"
+
+    finally:
+        # A rerun or Stop interrupts this thread (RerunException /
+        # StopException); cancel the requests instead of leaving them running.
+        if not future.done():
+            future.cancel()
+
+
+# ---------- Helpers: inbox batch analysis (OpenAI Batch API) ----------
+async def submit_inbox_batch(messages):
+    """
+    Submit one analysis request per inbox message to the OpenAI Batch API.
+    `messages` is a list of dicts with id + text.
+    Batches are cheaper than interactive calls and complete within 24h
+    (often within minutes).
+
+    Returns the batch id.
+    """
+    lines = [
+        json.dumps(
+            {
+                "custom_id": msg["id"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": analysis_request_body(msg["text"]),
+            }
+        )
+        for msg in messages
+    ]
+
+    async with get_request_semaphore():
+        batch_file = await client.files.create(
+            file=("inbox_batch.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch",
+        )
+
+    async with get_request_semaphore():
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
         )
 
-        raw_content = response.choices[0].message.content.strip()
+    return batch.id
+
+
+async def fetch_inbox_batch_results(batch_id: str):
+    """
+    Check the status of an inbox batch.
+
+    Returns a tuple (status, results, failed) where, once the batch is
+    completed, results is a dict {message_id: analysis} and failed is the
+    number of requests without a result. Otherwise results is None.
+    """
+    async with get_request_semaphore():
+        batch = await client.batches.retrieve(batch_id)
+
+    if batch.status != "completed":
+        return batch.status, None, 0
+
+    results = {}
+    skipped = 0
+
+    # A batch where every request failed completes without an output file
+    if batch.output_file_id:
+        async with get_request_semaphore():
+            output = await client.files.content(batch.output_file_id)
+
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                skipped += 1
+                continue
+            content = response["body"]["choices"][0]["message"]["content"]
+            results[item["custom_id"]] = json.loads(content)
+
+    if batch.request_counts:
+        failed = batch.request_counts.total - len(results)
+    else:
+        failed = skipped
+
+    return batch.status, results, failed
+
+
+# ---------- Helpers: render results ----------
+def render_analysis(result: dict):
+    """
+    Show language, urgency, sentiment, category, summary and action items.
+    """
+    st.subheader("Email analysis")
+
+    lang = result.get("language", "N/A")
+    urgency = result.get("urgency", "N/A")
+    sentiment = result.get("sentiment", "N/A")
+    category = result.get("category", "N/A")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Language", lang)
+    with col2:
+        st.metric("Urgency", urgency.capitalize())
+    with col3:
+        st.metric("Sentiment", sentiment.capitalize())
+    with col4:
+        st.metric("Category", category)
+
+    summary = result.get("summary") or ""
+    action_items = result.get("action_items") or []
+
+    if summary:
+        st.markdown("### Summary")
+        st.write(summary)
+
+    if action_items:
+        st.markdown("### Action items")
+        for item in action_items:
+            st.markdown(f"- {item}")
+
+
+def render_reply(reply_data: dict, option_number: int):
+    """
+    Show a single reply option (subject + body + copyable text area).
+    """
+    subject = reply_data.get("subject", "")
+    body = reply_data.get("body", "")
+
+    if subject:
+        st.markdown(f"**Subject:** {subject}")
 
-        # Try to parse JSON safely
+    st.markdown("**Body:**")
+    st.markdown(f"```text\n{body}\n```")
+
+    combined = subject + "\n\n" + body if subject else body
+    st.text_area(
+        f"Ready to copy (option {option_number})",
+        value=combined,
+        height=200,
+    )
+
+
+@st.fragment
+def render_results(result: dict):
+    """
+    Show the analysis and the reply options of a generation.
+    Runs as a fragment, so interacting with the results (e.g. editing
+    a reply) does not rerun the whole app.
+    """
+    render_analysis(result)
+
+    replies = result.get("replies") or []
+
+    if not replies:
+        st.warning("No reply options were returned by the AI.")
+    else:
+        st.markdown("### AI-generated reply options")
+
+        tab_labels = [f"Option {i+1}" for i in range(len(replies))]
+        tabs = st.tabs(tab_labels)
+
+        for i, (tab, reply_data) in enumerate(zip(tabs, replies)):
+            with tab:
+                render_reply(reply_data, i + 1)
+
+
+@st.fragment
+def render_gmail_inbox():
+    """
+    Show the Gmail inbox picker and the background analysis controls.
+    Runs as a fragment, so picking an email does not rerun the whole app.
+    """
+    if st.button("Load last emails from Gmail"):
         try:
-            data = json.loads(raw_content)
-        except json.JSONDecodeError:
-            # Sometimes the model may wrap JSON in ```json ... ``` – try to clean
-            cleaned = raw_content.strip()
-            if cleaned.startswith("```"):
-                cleaned = cleaned.strip("`")
-                # remove possible "json" prefix
-                if cleaned.lower().startswith("json"):
-                    cleaned = cleaned[4:].strip()
-            data = json.loads(cleaned)
-
-        return data
+            service = get_gmail_service()
+            with st.spinner("Loading inbox..."):
+                messages = list_gmail_messages(service, max_results=10)
+                st.session_state["gmail_messages"] = messages
+                # Prefetch bodies so that "Use this email" needs no extra round trip
+                st.session_state["gmail_bodies"] = prefetch_gmail_message_bodies(
+                    service, [m.id for m in messages]
+                )
+        except Exception as e:
+            st.error(f"Error while connecting to Gmail: {e}")
 
-    except Exception as e:
-        return f"Error while calling OpenAI API: {e}"
+    messages = st.session_state.get("gmail_messages", [])
+
+    if messages:
+        options = [
+            f"{i+1}. {m.subject} — {m.sender}  |  {m.snippet[:60]}..."
+            for i, m in enumerate(messages)
+        ]
+        selected = st.selectbox("Select an email", options, index=0)
+        selected_index = options.index(selected)
+        selected_msg = messages[selected_index]
+
+        if st.button("Use this email"):
+            try:
+                body = load_gmail_message_body(selected_msg.id)
+                st.session_state["email_text"] = body
+                st.success(
+                    "Email loaded from Gmail into the editor. "
+                    "Scroll down and click 'Analyze & generate replies'."
+                )
+            except Exception as e:
+                st.error(f"Error while fetching email body: {e}")
+
+        # ---------- Background inbox analysis ----------
+        # Filled at the end, so that results loaded below show up right away
+        precomputed_area = st.container()
+
+        if client is not None:
+            if st.button("Pre-analyze inbox in background"):
+                try:
+                    batch_messages = [
+                        {"id": m.id, "text": load_gmail_message_body(m.id)}
+                        for m in messages
+                    ]
+                    batch_id = run_async(submit_inbox_batch(batch_messages))
+                    st.session_state["inbox_batch_id"] = batch_id
+                    st.success(
+                        f"Batch submitted ({batch_id}). "
+                        "Click 'Check batch status' later to load the results."
+                    )
+                except Exception as e:
+                    st.error(f"Error while submitting the batch: {e}")
+
+            batch_id = st.session_state["inbox_batch_id"]
+            if batch_id and st.button("Check batch status"):
+                try:
+                    status, results, failed = run_async(
+                        fetch_inbox_batch_results(batch_id)
+                    )
+                    if status == "completed":
+                        st.session_state["inbox_analysis"].update(results)
+                        st.session_state["inbox_batch_id"] = None
+                        if not results:
+                            st.error(
+                                f"Batch completed but all {failed} requests failed. "
+                                "Submit it again to retry."
+                            )
+                        elif failed:
+                            st.warning(
+                                f"Batch completed: {len(results)} emails analyzed, "
+                                f"{failed} failed."
+                            )
+                        else:
+                            st.success(f"Batch completed: {len(results)} emails analyzed.")
+                    elif status in ("failed", "expired", "cancelled"):
+                        st.session_state["inbox_batch_id"] = None
+                        st.error(f"Batch {status}. Submit it again to retry.")
+                    else:
+                        st.info(f"Batch status: {status}")
+                except Exception as e:
+                    st.error(f"Error while checking the batch: {e}")
+
+        inbox_analysis = st.session_state["inbox_analysis"]
+        if selected_msg.id in inbox_analysis:
+            with precomputed_area:
+                with st.expander("Pre-computed analysis", expanded=True):
+                    render_analysis(inbox_analysis[selected_msg.id])
+    else:
+        st.info("Click 'Load last emails from Gmail' to fetch your inbox.")
 
 
 # ---------- Sidebar options ----------
@@ -352,38 +1088,7 @@ else:
         "(credentials.json + token.json)."
     )
 
-    if st.button("Load last emails from Gmail"):
-        try:
-            service = get_gmail_service()
-            messages = list_gmail_messages(service, max_results=10)
-            st.session_state["gmail_messages"] = messages
-        except Exception as e:
-            st.error(f"Error while connecting to Gmail: {e}")
-
-    messages = st.session_state.get("gmail_messages", [])
-
-    if messages:
-        options = [
-            f'{i+1}. {m["subject"]} — {m["from"]}  |  {m["snippet"][:60]}...'
-            for i, m in enumerate(messages)
-        ]
-        selected = st.selectbox("Select an email", options, index=0)
-        selected_index = options.index(selected)
-        selected_msg = messages[selected_index]
-
-        if st.button("Use this email"):
-            try:
-                service = get_gmail_service()
-                body = get_gmail_message_body(service, selected_msg["id"])
-                st.session_state["email_text"] = body
-                st.success(
-                    "Email loaded from Gmail into the editor. "
-                    "Scroll down and click 'Analyze & generate replies'."
-                )
-            except Exception as e:
-                st.error(f"Error while fetching email body: {e}")
-    else:
-        st.info("Click 'Load last emails from Gmail' to fetch your inbox.")
+    render_gmail_inbox()
 
 email_text = st.session_state.get("email_text", "")
 analyze_button = st.button("Analyze & generate replies ✉️")
@@ -397,74 +1102,38 @@ if analyze_button:
     elif client is None:
         st.error("OpenAI client is not configured. Check your API key.")
     else:
-        with st.spinner("Analyzing email and generating replies..."):
-            result = analyze_and_reply(
-                email_text=email_text,
-                tone=tone,
-                formality=formality,
-                length=length,
-                num_options=num_options,
-            )
+        cache_key = generation_cache_key(
+            email_text, tone, formality, length, num_options
+        )
+        result_cache, result_cache_lock = get_result_cache()
+        with result_cache_lock:
+            result = result_cache.get(cache_key)
+
+        if result is None:
+            # Replies are streamed here while they are generated, then
+            # replaced by the results fragment below.
+            live_area = st.empty()
+            with live_area.container():
+                with st.spinner("Analyzing email and generating replies..."):
+                    result = analyze_and_reply(
+                        email_text=email_text,
+                        tone=tone,
+                        formality=formality,
+                        length=length,
+                        num_options=num_options,
+                    )
+            live_area.empty()
+
+            if not isinstance(result, str):
+                with result_cache_lock:
+                    result_cache[cache_key] = result
 
         if isinstance(result, str):
             # Error message
+            st.session_state["result"] = None
             st.error(result)
         else:
-            # ---------- Show analysis ----------
-            st.subheader("Email analysis")
-
-            lang = result.get("language", "N/A")
-            urgency = result.get("urgency", "N/A")
-            sentiment = result.get("sentiment", "N/A")
-            category = result.get("category", "N/A")
-
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Language", lang)
-            with col2:
-                st.metric("Urgency", urgency.capitalize())
-            with col3:
-                st.metric("Sentiment", sentiment.capitalize())
-            with col4:
-                st.metric("Category", category)
-
-            summary = result.get("summary") or ""
-            action_items = result.get("action_items") or []
-
-            if summary:
-                st.markdown("### Summary")
-                st.write(summary)
-
-            if action_items:
-                st.markdown("### Action items")
-                for item in action_items:
-                    st.markdown(f"- {item}")
-
-            # ---------- Show reply options ----------
-            replies = result.get("replies") or []
-
-            if not replies:
-                st.warning("No reply options were returned by the AI.")
-            else:
-                st.markdown("### AI-generated reply options")
-
-                tab_labels = [f"Option {i+1}" for i in range(len(replies))]
-                tabs = st.tabs(tab_labels)
-
-                for tab, reply_data in zip(tabs, replies):
-                    with tab:
-                        subject = reply_data.get("subject", "")
-                        body = reply_data.get("body", "")
-
-                        if subject:
-                            st.markdown(f"**Subject:** {subject}")
-
-                        st.markdown("**Body:**")
-                        st.markdown(f"```text\n{body}\n```")
+            st.session_state["result"] = result
 
-                        combined = subject + "\n\n" + body if subject else body
-                        st.text_area(
-                            "Ready to copy",
-                            value=combined,
-                            height=200,
-                        )
\ No newline at end of file
+if st.session_state["result"]:
+    render_results(st.session_state["result"])
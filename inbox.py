@@ -0,0 +1,15 @@
+from dataclasses import dataclass
+
+
+# Defined outside app.py so that instances can be pickled by st.cache_data
+# and session state (classes defined in the Streamlit script cannot be).
+@dataclass(slots=True)
+class InboxItem:
+    """
+    Basic info about a message in the Gmail inbox.
+    """
+
+    id: str
+    sender: str
+    subject: str
+    snippet: str
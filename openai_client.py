@@ -0,0 +1,78 @@
+import os
+import asyncio
+import functools
+import threading
+
+import httpx
+from openai import AsyncOpenAI
+
+# ---------- Shared OpenAI client ----------
+#
+# A single AsyncOpenAI client (and HTTP/2 connection pool) is shared by every
+# Streamlit session and rerun. Pooled connections are bound to the event loop
+# that opened them, so all OpenAI coroutines run on one long-lived loop in a
+# background thread instead of a fresh asyncio.run() loop per click.
+
+
+@functools.lru_cache(maxsize=1)
+def get_event_loop():
+    """
+    Returns the event loop used for all OpenAI calls.
+    It is started once, in a daemon thread.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="openai-loop", daemon=True)
+    thread.start()
+    return loop
+
+
+# Maximum number of OpenAI requests in flight at the same time, across all
+# sessions
+MAX_CONCURRENT_REQUESTS = 8
+
+
+@functools.lru_cache(maxsize=1)
+def get_request_semaphore():
+    """
+    Returns the semaphore capping in-flight OpenAI requests.
+    Only use it from coroutines running on the shared event loop.
+    """
+    return asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+
+@functools.lru_cache(maxsize=1)
+def get_client():
+    """
+    Returns the shared AsyncOpenAI client, or None if OPENAI_API_KEY is not set.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+
+    return AsyncOpenAI(
+        api_key=api_key,
+        timeout=30.0,
+        # Retries are handled by tenacity in app.py; SDK retries on top of
+        # those would multiply the number of attempts.
+        max_retries=0,
+        http_client=httpx.AsyncClient(
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+        ),
+    )
+
+
+def submit_async(coro):
+    """
+    Schedule a coroutine on the shared event loop.
+    Returns a concurrent.futures.Future with its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_async(coro):
+    """
+    Run a coroutine on the shared event loop and wait for its result.
+    """
+    return submit_async(coro).result()